@@ -0,0 +1,733 @@
+# Order parsing shared by the web app and its parse pool workers. Importing this module
+# has no side effects (no database, threads or Socket.IO), so workers start from it alone.
+import os
+import re
+import unicodedata
+import threading
+import itertools
+from collections import Counter, OrderedDict
+from bisect import bisect_left, bisect_right
+
+# ---------- Core Order Processing Functions ----------
+
+def normalize(text):
+    text = text.lower()
+    text = ''.join(c for c in unicodedata.normalize('NFD', text)
+                   if unicodedata.category(c) != 'Mn')
+    return text.strip() 
+
+try:
+    # Optional C implementation; the pure-Python version below is used without it
+    from rapidfuzz.distance import Levenshtein as _fast_levenshtein
+except ImportError:
+    _fast_levenshtein = None
+
+def levenshtein_distance(a, b, max_distance=None):
+    """
+    Edit distance between a and b. When max_distance is given the computation stops
+    as soon as the distance is known to exceed it, and max_distance + 1 is returned.
+    """
+    m, n = len(a), len(b)
+    if max_distance is not None and abs(m - n) > max_distance:
+        return max_distance + 1
+    if _fast_levenshtein is not None:
+        return _fast_levenshtein.distance(a, b, score_cutoff=max_distance)
+    if m == 0: return n
+    if n == 0: return m
+    if m < n:
+        a, b, m, n = b, a, n, m
+    # Two rows over the shorter string instead of the full (m+1) x (n+1) matrix
+    previous = list(range(n + 1))
+    for i in range(1, m + 1):
+        current = [i] + [0] * n
+        ca = a[i - 1]
+        for j in range(1, n + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + cost
+            )
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[n]
+
+def similarity_percentage(a, b, min_score=0):
+    return normalized_similarity(normalize(a), normalize(b), min_score)
+
+def normalized_similarity(a, b, min_score=0):
+    """
+    Similarity percentage for strings that are already normalized.
+    Pairs that cannot reach min_score are rejected early and scored 0.
+    """
+    max_len = max(len(a), len(b))
+    if max_len == 0:
+        return 100.0
+    # One extra edit of slack so float rounding never rejects a pair exactly at min_score
+    max_distance = int((1 - min_score / 100) * max_len) + 1
+    distance = levenshtein_distance(a, b, max_distance)
+    if distance > max_distance:
+        return 0.0
+    return (1 - distance / max_len) * 100
+
+units = {
+    "0":0, "1":1, "2":2, "3":3, "4":4, "5":5, "6":6, "7":7, "8":8, "9":9,
+    "zero":0, "um":1, "uma":1, "dois":2, "duas":2, "dos":2, "tres":3, "tres":3, "treis": 3,
+    "quatro":4, "quarto":4, "cinco":5, "cnico": 5, "seis":6, "ses":6, "sete":7, "oito":8, "nove":9, "nov": 9
+}
+teens = {
+    "dez":10, "onze":11, "doze":12, "treze":13, "quatorze":14, "catorze":14,
+    "quinze":15, "dezesseis":16, "dezessete":17, "dezoito":18, "dezenove":19
+}
+tens = {
+    "vinte":20, "trinta":30, "quarenta":40, "cinquenta":50, "sessenta":60,
+    "setenta":70, "oitenta":80, "noventa":90
+}
+hundreds = {
+    "cem":100, "cento":100, "duzentos":200, "trezentos":300, "quatrocentos":400,
+    "quinhentos":500, "seiscentos":600, "setecentos":700, "oitocentos":800,
+    "novecentos":900
+}
+word2num_all = {**units, **teens, **tens, **hundreds}
+
+def parse_number_words(tokens):
+    """Parse list of number-word tokens (no 'e' tokens) into integer (supports up to 999)."""
+    total = 0
+    i = 0
+    while i < len(tokens):
+        t = tokens[i]
+        if t in hundreds:
+            total += hundreds[t]
+            i += 1
+        elif t in tens:
+            val = tens[t]
+            if i + 1 < len(tokens) and tokens[i+1] in units:
+                val += units[tokens[i+1]]
+                i += 2
+            else:
+                i += 1
+            total += val
+        elif t in teens:
+            total += teens[t]; i += 1
+        elif t in units:
+            total += units[t]; i += 1
+        else:
+            i += 1
+    return total if total > 0 else None
+
+# Compiled once: the digit/letter split, the compound teens that are split even inside
+# words, and every other number word as a whole word (longest first)
+PROTECTED_TEENS = ("dezesseis", "dezessete", "dezoito", "dezenove")
+_DIGIT_LETTER_RE = re.compile(r"(?<=\d)(?=[a-zA-Z])|(?<=[a-zA-Z])(?=\d)")
+_PROTECTED_TEENS_RE = re.compile("|".join(PROTECTED_TEENS))
+_NUMBER_WORDS_RE = re.compile(r"\b(?:%s)\b" % "|".join(
+    re.escape(w) for w in sorted(word2num_all, key=len, reverse=True) if w not in PROTECTED_TEENS
+))
+_PUNCTUATION_RE = re.compile(r"[,\.;\+\-\/\(\)\[\]\:]")
+FILLER_WORDS = frozenset({"quero", "e"})
+
+def _split_number_words(text):
+    text = _DIGIT_LETTER_RE.sub(" ", text.lower())
+    text = _PROTECTED_TEENS_RE.sub(r" \g<0> ", text)
+    return _NUMBER_WORDS_RE.sub(r" \g<0> ", text)
+
+def separate_numbers_and_words(text):
+    """Insert spaces between digit-word and between number-words glued to words."""
+    return " ".join(_split_number_words(text).split())
+
+def tokenize_order(message):
+    """
+    Normalize a message and split it into tokens in a single pipeline.
+    Returns (tokens, numbers_with_positions, number_flags), where number_flags[i]
+    tells whether tokens[i] is a digit or a number word.
+    """
+    text = _split_number_words(normalize(message))
+    tokens = _PUNCTUATION_RE.sub(" ", text).split()
+    number_flags = [t.isdigit() or t in word2num_all for t in tokens]
+    return tokens, extract_numbers_and_positions(tokens), number_flags
+
+def extract_numbers_and_positions(tokens):
+    """Extract all numbers and their positions from tokens"""
+    numbers = []
+    
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isdigit():
+            numbers.append((i, int(tokens[i])))
+            i += 1
+        elif tokens[i] in word2num_all:
+            # Only combine number words if they're connected by "e"
+            num_tokens = [tokens[i]]
+            j = i + 1
+            
+            # Look for "e" followed by a number word
+            while j < len(tokens) - 1:
+                if tokens[j] == "e" and tokens[j+1] in word2num_all:
+                    num_tokens.extend([tokens[j], tokens[j+1]])
+                    j += 2
+                else:
+                    break
+            
+            # Parse the number tokens
+            number = parse_number_words([t for t in num_tokens if t != "e"])
+            if number:
+                numbers.append((i, number))
+                i = j
+            else:
+                i += 1
+        else:
+            i += 1
+            
+    return numbers
+
+class AvailableNumbers:
+    """
+    The quantities of one message that no product has taken yet, by token position.
+    nearest() finds the closest free number before (else after) a position with a
+    bisect plus union-find links that skip taken numbers in either direction.
+    """
+    __slots__ = ('positions', 'values', '_left', '_right')
+
+    def __init__(self, numbers_with_positions):
+        numbers = sorted(numbers_with_positions)
+        self.positions = [pos for pos, _ in numbers]
+        self.values = [val for _, val in numbers]
+        # _left[k + 1] leads to the free slot at or before k (slot -1 means none);
+        # _right[k] leads to the free slot at or after k (slot len means none)
+        self._left = list(range(len(numbers) + 1))
+        self._right = list(range(len(numbers) + 1))
+
+    @staticmethod
+    def _find(links, k):
+        root = k
+        while links[root] != root:
+            root = links[root]
+        while links[k] != root:
+            links[k], k = root, links[k]
+        return root
+
+    def nearest(self, product_position, take=True):
+        """(value, position) of the closest free number before the product, else after it; (1, None) if none"""
+        before = self._find(self._left, bisect_left(self.positions, product_position)) - 1
+        if before >= 0:
+            slot = before
+        else:
+            slot = self._find(self._right, bisect_right(self.positions, product_position))
+            if slot == len(self.positions):
+                return 1, None
+        if take:
+            self._left[slot + 1] = slot
+            self._right[slot] = slot + 1
+        return self.values[slot], self.positions[slot]
+
+def find_associated_number(product_position, all_tokens, numbers_with_positions, used_number_positions):
+    """
+    Find the number associated with a product based on word order patterns:
+    the closest unused number before the product (a number right before it is
+    the closest), otherwise the closest one after it.
+    """
+    available = AvailableNumbers((pos, val) for pos, val in numbers_with_positions
+                                 if pos not in used_number_positions)
+    return available.nearest(product_position, take=False)
+
+NGRAM_SIZE = 3
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    """Multiset of padded character n-grams of text."""
+    padded = "\0" * (n - 1) + text + "\0" * (n - 1)
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+_index_versions = itertools.count(1)
+
+# Trie spans are resolved at this score, so they answer any threshold at or above it
+SPAN_FAST_PATH_MIN_SCORE = 80
+_SPAN_END = None
+
+def plural(word):
+    """Portuguese plural of a normalized word."""
+    if word.endswith('ao'):
+        return word[:-2] + 'oes'
+    if word.endswith(('r', 'z')):
+        return word + 'es'
+    if word.endswith('m'):
+        return word[:-1] + 'ns'
+    if word.endswith('l'):
+        return word[:-1] + 'is'
+    if word.endswith('s'):
+        return word
+    return word + 's'
+
+def name_variants(words):
+    """The name itself plus the plurals a customer is likely to type."""
+    variants = {tuple(words)}
+    if words:
+        variants.add(tuple(words[:-1]) + (plural(words[-1]),))
+        variants.add((plural(words[0]),) + tuple(words[1:]))
+    return variants
+
+class ProductIndex:
+    """Matching data precomputed once per product catalog."""
+
+    def __init__(self, product_names, cache=None):
+        # Unique per build, so cached matches never outlive the catalog they were computed on
+        self.version = next(_index_versions)
+        # MatchCache for this index's matches; None means the shared match_cache
+        self.cache = cache
+        self.names = product_names if isinstance(product_names, tuple) else tuple(product_names)
+        self.normalized = [normalize(p) for p in self.names]
+        self.word_counts = [len(p.split()) for p in self.names]
+        # Sort products by word count (longest first) to prioritize multi-word matches
+        self.sorted_products = sorted(range(len(self.names)),
+                                      key=lambda i: self.word_counts[i], reverse=True)
+        self.max_prod_words = max(self.word_counts)
+        self.sorted_rank = [0] * len(self.names)
+        for rank, idx in enumerate(self.sorted_products):
+            self.sorted_rank[idx] = rank
+        # The set of words that appear in any product name
+        self.product_words = {normalize(word) for p in self.names for word in p.split()}
+
+        # Products bucketed by normalized length, and an inverted index of their n-grams
+        self.length_buckets = {}
+        self.ngram_postings = {}
+        for idx, name in enumerate(self.normalized):
+            self.length_buckets.setdefault(len(name), []).append(idx)
+            for gram, count in char_ngrams(name).items():
+                self.ngram_postings.setdefault(gram, []).append((idx, count))
+
+        # Token trie over the normalized names and their plurals; a terminal holds
+        # [phrase, match], the match being resolved by the fuzzy scan on first use
+        self.span_trie = {}
+        for name in self.normalized:
+            for words in name_variants(name.split()):
+                node = self.span_trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node.setdefault(_SPAN_END, [" ".join(words), None])
+
+    def candidates(self, phrase_norm, min_score, key=None):
+        """
+        Products that can still reach min_score against phrase_norm, sorted by key.
+        Uses the length window allowed by the score and the q-gram count filter:
+        strings within edit distance k share at least max_len - 1 - (k - 1) * q n-grams.
+        """
+        if min_score <= 0:
+            return sorted(range(len(self.names)), key=key)
+        ratio = min_score / 100
+        length = len(phrase_norm)
+        # |len(a) - len(b)| <= distance <= (1 - ratio) * max_len bounds the product length
+        min_len = int(length * ratio)
+        max_len = int(length / ratio) + 1
+
+        shared = Counter()
+        for gram, count in char_ngrams(phrase_norm).items():
+            for idx, prod_count in self.ngram_postings.get(gram, ()):
+                shared[idx] += min(count, prod_count)
+
+        result = []
+        for prod_len in range(min_len, max_len + 1):
+            for idx in self.length_buckets.get(prod_len, ()):
+                longest = max(length, prod_len)
+                # Same one-edit slack as normalized_similarity
+                max_distance = int((1 - ratio) * longest) + 1
+                if shared[idx] >= longest - 1 - (max_distance - 1) * NGRAM_SIZE:
+                    result.append(idx)
+        result.sort(key=key)
+        return result
+
+    def exact_spans(self, tokens, start, max_size):
+        """
+        Walk the trie once from tokens[start] and return {size: (original_idx, score)}
+        for every known name or variant that starts there.
+        """
+        spans = {}
+        node = self.span_trie
+        for k in range(start, min(len(tokens), start + max_size)):
+            node = node.get(tokens[k])
+            if node is None:
+                break
+            entry = node.get(_SPAN_END)
+            if entry is not None:
+                size = k - start + 1
+                if entry[1] is None:
+                    # Same answer the fuzzy scan gives, so the fast path never changes a match
+                    entry[1] = best_product_match(entry[0], self, size, SPAN_FAST_PATH_MIN_SCORE)
+                spans[size] = entry[1]
+        return spans
+
+class SpanStats:
+    """Counts of product windows resolved by the exact-span trie vs the fuzzy scan."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fast_path = 0
+        self.fuzzy = 0
+
+    def record(self, fast_path, fuzzy):
+        with self._lock:
+            self.fast_path += fast_path
+            self.fuzzy += fuzzy
+
+    def stats(self):
+        with self._lock:
+            total = self.fast_path + self.fuzzy
+            return {
+                'fast_path': self.fast_path,
+                'fuzzy': self.fuzzy,
+                'fast_path_share': round(self.fast_path / total, 4) if total else None
+            }
+
+span_stats = SpanStats()
+
+class MatchCache:
+    """Bounded LRU cache of phrase -> best product matches."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+match_cache = MatchCache(int(os.environ.get('MATCH_CACHE_SIZE', 10000)))
+
+def best_product_match(phrase_norm, product_index, window_size, min_score, ranked=True):
+    """
+    Best (original_idx, score) for a normalized phrase among products that can reach min_score.
+    Ranked scans follow the longest-first product order, otherwise catalog order is used;
+    the first product wins ties either way.
+    """
+    cache = match_cache if product_index.cache is None else product_index.cache
+    key = (product_index.version, phrase_norm, window_size, min_score, ranked)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    best_score = 0
+    best_idx = None
+    order = product_index.sorted_rank.__getitem__ if ranked else None
+    for idx in product_index.candidates(phrase_norm, min_score, key=order):
+        score = normalized_similarity(phrase_norm, product_index.normalized[idx],
+                                      max(min_score, best_score))
+        if score > best_score:
+            best_score = score
+            best_idx = idx
+
+    result = (best_idx, best_score)
+    cache.put(key, result)
+    return result
+
+class Catalog(tuple):
+    """Immutable product names shared by every cart"""
+
+    def __new__(cls, names):
+        catalog = super().__new__(cls, names)
+        catalog.positions = {}
+        for idx, name in enumerate(catalog):
+            catalog.positions.setdefault(name, idx)
+        return catalog
+
+class Cart:
+    """Sparse product index -> quantity mapping over a shared Catalog"""
+    __slots__ = ('catalog', 'quantities')
+
+    def __init__(self, catalog, quantities=None):
+        self.catalog = catalog
+        self.quantities = dict(quantities) if quantities else {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a cart from a list of [name, qty] rows"""
+        return cls(Catalog(name for name, _ in rows),
+                   {idx: qty for idx, (_, qty) in enumerate(rows) if qty})
+
+    def copy(self):
+        return Cart(self.catalog, self.quantities)
+
+    def add(self, idx, qty):
+        self.quantities[idx] = self.quantities.get(idx, 0) + qty
+
+    def add_product(self, name, qty):
+        idx = self.catalog.positions.get(name)
+        if idx is not None:
+            self.add(idx, qty)
+
+    def has_items(self):
+        return any(qty > 0 for qty in self.quantities.values())
+
+    def items(self):
+        """Ordered products with a positive quantity, as a name -> qty dict"""
+        return {self.catalog[idx]: qty for idx, qty in sorted(self.quantities.items()) if qty > 0}
+
+    def __iter__(self):
+        # Same (name, qty) rows as the old list-based products_db
+        for idx, name in enumerate(self.catalog):
+            yield name, self.quantities.get(idx, 0)
+
+    def __len__(self):
+        return len(self.catalog)
+
+_product_index = None
+_product_index_lock = threading.Lock()
+
+def get_product_index(products_db):
+    """Return the shared ProductIndex, rebuilding it only when the catalog changes."""
+    global _product_index
+    if isinstance(products_db, Cart):
+        names = products_db.catalog
+    else:
+        names = tuple(p for p, _ in products_db)
+    index = _product_index
+    if index is not None and (index.names is names or index.names == names):
+        return index
+    with _product_index_lock:
+        if _product_index is None or _product_index.names != names:
+            _product_index = ProductIndex(names)
+            # Entries keyed on the old catalog version can no longer be hit
+            match_cache.clear()
+        return _product_index
+
+def parse_order_interactive(message, products_db, similarity_threshold=80, uncertain_range=(60, 80), product_index=None):
+    """
+    Interactive version that uses pattern-based quantity association with multi-word product support.
+    Fixed to handle multiple products with quantities in the same message.
+    """
+    if product_index is None:
+        product_index = get_product_index(products_db)
+
+    tokens, numbers_with_positions, number_flags = tokenize_order(message)
+
+    # Start with the current database state (accumulate items)
+    if isinstance(products_db, Cart):
+        working_db = products_db.copy()
+    else:
+        working_db = Cart.from_rows(products_db)
+    parsed_orders = []
+
+    product_names = product_index.names
+    max_prod_words = product_index.max_prod_words
+    product_words = product_index.product_words
+    # Tokens that can never be part of a product phrase
+    blocked = [number_flags[k] or (t in FILLER_WORDS and t not in product_words)
+               for k, t in enumerate(tokens)]
+
+    # Exact names and plurals skip the fuzzy scan; lower thresholds always scan
+    use_fast_path = similarity_threshold >= SPAN_FAST_PATH_MIN_SCORE
+    fast_spans = fuzzy_spans = 0
+
+    used_positions = set()  # Track used token positions
+    number_positions = sorted(pos for pos, _ in numbers_with_positions)
+    number_position_set = set(number_positions)
+
+    # Create a list to store all potential product matches with their positions
+    potential_matches = []
+    
+    # First pass: find all potential product matches and their positions
+    i = 0
+    while i < len(tokens):
+        if i in used_positions:
+            i += 1
+            continue
+
+        token = tokens[i]
+
+        # Skip filler words and numbers only if they are not part of a product name
+        if (token in FILLER_WORDS and token not in product_words) or (token.isdigit() and i not in number_position_set) or token in word2num_all:
+            i += 1
+            continue
+
+        matched = False
+        max_size = min(max_prod_words, 4)
+        spans = product_index.exact_spans(tokens, i, max_size) if use_fast_path else {}
+        
+        # Try different phrase lengths (longest first) - prioritize multi-word products
+        for size in range(max_size, 0, -1):
+            if i + size > len(tokens):
+                continue
+                
+            # Skip if any token in the phrase is already used or is a number/filler (unless part of product)
+            phrase_tokens = tokens[i:i+size]
+            skip_phrase = False
+            for j in range(size):
+                if i+j in used_positions or blocked[i+j]:
+                    skip_phrase = True
+                    break
+                    
+            if skip_phrase:
+                continue
+                
+            exact = spans.get(size)
+            if exact is not None:
+                best_original_idx, best_score = exact
+                fast_spans += 1
+            else:
+                # Tokens come from the normalized message, so the phrase is already normalized
+                phrase_norm = " ".join(phrase_tokens)
+
+                # Find best match for this phrase length (check against sorted products)
+                best_original_idx, best_score = best_product_match(
+                    phrase_norm, product_index, size, similarity_threshold
+                )
+                fuzzy_spans += 1
+
+            # Handle the match
+            if best_original_idx is not None and best_score >= similarity_threshold:
+                potential_matches.append({
+                    'start_pos': i,
+                    'end_pos': i + size - 1,
+                    'product': product_names[best_original_idx],
+                    'original_idx': best_original_idx,
+                    'score': best_score
+                })
+                
+                # Mark positions as used for this iteration
+                for j in range(size):
+                    used_positions.add(i + j)
+                
+                i += size
+                matched = True
+                break
+
+        if not matched:
+            # If no match found, find the best match to suggest
+            best_original_idx, best_score = best_product_match(
+                tokens[i], product_index, 1, 50, ranked=False
+            )
+            
+            if best_original_idx is not None and best_score > 50:
+                potential_matches.append({
+                    'start_pos': i,
+                    'end_pos': i,
+                    'product': product_names[best_original_idx],
+                    'original_idx': best_original_idx,
+                    'score': best_score
+                })
+                        
+                used_positions.add(i)
+                matched = True
+            
+            i += 1
+
+    span_stats.record(fast_spans, fuzzy_spans)
+
+    # Reset used_positions for the second pass
+    used_positions.clear()
+    
+    # **SECOND PASS: Process matches in order of their relationship to numbers**
+    # Sort potential matches by their proximity to numbers. No number is taken yet
+    # when this runs, so each check only needs the number flags and the extremes.
+    def get_match_priority(match):
+        start_pos = match['start_pos']
+        
+        # Check for number immediately before (highest priority)
+        if start_pos > 0 and number_flags[start_pos - 1]:
+            return 0  # Highest priority
+        
+        # Check for any number before
+        if number_positions and number_positions[0] < start_pos:
+            return 1
+        
+        # Check for number immediately after
+        if start_pos + 1 < len(tokens) and number_flags[start_pos + 1]:
+            return 2
+        
+        # Check for any number after
+        if number_positions and number_positions[-1] > start_pos:
+            return 3
+        
+        return 4  # No number association
+    
+    # Sort matches by priority
+    potential_matches.sort(key=get_match_priority)
+    
+    # Process matches in priority order; each takes the closest free number
+    available_numbers = AvailableNumbers(numbers_with_positions)
+    for match in potential_matches:
+        quantity, _ = available_numbers.nearest(match['start_pos'])
+        
+        # Update the working database (add to existing quantity)
+        working_db.add(match['original_idx'], quantity)
+        parsed_orders.append({
+            "product": match['product'], 
+            "qty": quantity, 
+            "score": round(match['score'], 2)
+        })
+        
+        # Mark product positions as used
+        for pos in range(match['start_pos'], match['end_pos'] + 1):
+            used_positions.add(pos)
+
+    return parsed_orders, working_db
+
+
+# ---------- Initialize products_db ----------
+products_db = [
+    ["limão", 0],
+    ["abacaxi", 0], ["abacaxi com hortelã", 0], ["açaí", 0], ["acerola", 0],
+    ["ameixa", 0], ["cajá", 0], ["cajú", 0], ["goiaba", 0], ["graviola", 0],
+    ["manga", 0], ["maracujá", 0], ["morango", 0], ["seriguela", 0], ["tamarindo", 0],
+    ["caixa de ovos", 0], ["ovo", 0], ["queijo", 0]
+]
+# Shared by every session's cart
+CATALOG = Catalog(name for name, _ in products_db)
+
+
+# ---------- Parse pool workers ----------
+_worker_catalog = None
+
+def init_parse_worker(product_names):
+    """Pool initializer: build the catalog and its product index once per worker process"""
+    global _worker_catalog
+    _worker_catalog = Catalog(product_names)
+    get_product_index(Cart(_worker_catalog))
+
+def parse_in_worker(message, quantities):
+    parsed_orders, updated_db = parse_order_interactive(message, Cart(_worker_catalog, quantities))
+    return parsed_orders, updated_db.quantities
+
+def parse_messages(messages, product_names):
+    """Parse a chunk of messages against a catalog; also runs inside pool workers"""
+    cart = Cart(Catalog(product_names))
+    if product_names == CATALOG:
+        product_index = get_product_index(cart)
+    else:
+        # A one-off catalog gets its own index and match cache, so the shared index
+        # and the cached matches of live sessions are left alone
+        product_index = ProductIndex(product_names, cache=MatchCache())
+    return [
+        parse_order_interactive(message, cart, product_index=product_index)[0]
+        for message in messages
+    ]
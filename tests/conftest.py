@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# app.py creates its databases and order journal in the working directory at import
+_workdir = tempfile.mkdtemp(prefix="pedidos-tests-")
+os.chdir(_workdir)
+os.environ['ORDER_JOURNAL_DIR'] = os.path.join(_workdir, 'order_journal')
+# Plain threads, so the tests never depend on the eventlet hub
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'threading')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
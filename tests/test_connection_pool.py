@@ -0,0 +1,58 @@
+import os
+
+import app
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.pid = os.getpid()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def _in_child(check):
+    """Run check() in a forked child; True when it passed there"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            code = 0 if check() else 1
+        except BaseException:
+            code = 2
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def test_forked_process_never_reuses_pooled_connections():
+    pool = app.ConnectionPool(FakeConnection, max_size=2, timeout=0.5)
+    idle, busy = pool.acquire(), pool.acquire()
+    pool.release(idle)
+
+    def check():
+        # Both slots are free again: busy's holder does not exist in the child
+        conns = [pool.acquire(), pool.acquire()]
+        return (all(conn.pid == os.getpid() for conn in conns)
+                and not idle.closed and pool.stats()['in_use'] == 2)
+    assert _in_child(check)
+    pool.release(busy)
+    assert pool.acquire() is busy and pool.acquire() is idle
+
+
+def test_forked_process_opens_its_own_sqlite_connection():
+    with app.db_connection() as parent_conn:
+        pass
+
+    def check():
+        with app.db_connection() as conn:
+            conn.execute('SELECT 1')
+        # The parent's connection is left open for the parent
+        parent_conn.execute('SELECT 1')
+        return conn is not parent_conn
+    assert _in_child(check)
+    with app.db_connection() as conn:
+        assert conn is parent_conn
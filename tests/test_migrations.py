@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+
+import pytest
+
+import app
+
+ROWS = 1_000_000
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point the app at an empty SQLite file of its own"""
+    path = str(tmp_path / 'orders.db')
+
+    def connect():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    monkeypatch.setattr(app, 'get_db_connection', connect)
+    monkeypatch.setattr(app, '_sqlite_local', threading.local())
+    return path
+
+
+def _schema_version(conn):
+    return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+
+
+def test_sidebar_and_auto_group_queries_use_indexes(database, monkeypatch):
+    app.migrate_db()
+    with app.db_connection() as conn:
+        # 90% main orders, the rest spread over 5000 auto-confirmed groups
+        conn.execute(f'''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {ROWS - 1})
+            INSERT INTO confirmed_orders (session_id, product, quantity, status, order_group)
+            SELECT 's' || (i % 50000), 'p' || (i % 18), 1 + i % 3,
+                   CASE WHEN i % 10 THEN 'confirmed' ELSE 'auto_confirmed' END,
+                   CASE WHEN i % 10 THEN 'main' ELSE 'auto_' || (i % 5000) END
+            FROM n
+        ''')
+        conn.execute(app.ORDER_TOTALS_BACKFILL)
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
+
+    # Capture the statements the repository really runs
+    statements = []
+    execute = app.DIALECT.execute
+
+    def recording_execute(cur, name, query, params=()):
+        statements.append((name, query, tuple(params)))
+        return execute(cur, name, query, params)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app.DIALECT, 'execute', recording_execute)
+        app.orders_repo.global_orders()
+        app.orders_repo.confirm_auto_group('auto_70')
+        app.orders_repo.delete_auto_group('auto_80')
+
+    plans = {}
+    with app.db_connection() as conn:
+        # The group deleted above had ROWS / 5000 lines
+        assert conn.execute('SELECT COUNT(*) FROM confirmed_orders').fetchone()[0] == ROWS - ROWS // 5000
+        for name, query, params in statements:
+            plans[name] = ' '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+        # The per-product aggregate the sidebar used to run on the raw rows
+        plans['raw_totals'] = ' '.join(row[3] for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT product, SUM(quantity) FROM confirmed_orders
+            WHERE status = ? AND order_group = ? GROUP BY product
+        ''', ('confirmed', 'main')))
+
+    assert set(plans) == {'main_totals', 'auto_orders', 'confirm_auto_group', 'delete_auto_group',
+                          'take_totals', 'raw_totals'}
+    for name in ('main_totals', 'auto_orders', 'take_totals'):
+        assert 'SEARCH order_totals USING' in plans[name] and 'INDEX sqlite_autoindex_order_totals_1' in plans[name]
+    for name in ('confirm_auto_group', 'delete_auto_group'):
+        assert 'USING INDEX idx_confirmed_orders_group_status (order_group=? AND status=?)' in plans[name]
+    assert 'USING INDEX idx_confirmed_orders_status_group_product (status=? AND order_group=?)' in plans['raw_totals']
+    assert not any('SCAN' in plan for plan in plans.values())
+
+
+def test_legacy_table_is_migrated_in_place(database):
+    # confirmed_orders as created before status and order_group existed
+    conn = sqlite3.connect(database)
+    conn.execute('''
+        CREATE TABLE confirmed_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            product TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('INSERT INTO confirmed_orders (session_id, product, quantity) VALUES (?, ?, ?)',
+                     [('a', 'manga', 2), ('b', 'manga', 3), ('b', 'queijo', 1)])
+    conn.commit()
+    conn.close()
+
+    app.migrate_db()
+
+    with app.db_connection() as conn:
+        assert _schema_version(conn) == app.MIGRATIONS[-1][0]
+        rows = conn.execute('''
+            SELECT session_id, product, quantity, status, order_group FROM confirmed_orders ORDER BY id
+        ''').fetchall()
+        indexes = {row[1] for row in conn.execute('PRAGMA index_list(confirmed_orders)')}
+    assert [tuple(row) for row in rows] == [
+        ('a', 'manga', 2, 'confirmed', 'main'),
+        ('b', 'manga', 3, 'confirmed', 'main'),
+        ('b', 'queijo', 1, 'confirmed', 'main'),
+    ]
+    assert {'idx_confirmed_orders_status_group_product', 'idx_confirmed_orders_group_status'} <= indexes
+    main_orders, auto_orders = app.orders_repo.global_orders()
+    assert [tuple(row) for row in main_orders] == [('manga', 5), ('queijo', 1)]
+    assert auto_orders == []
+
+    # Up to date: a second run applies nothing and changes nothing
+    app.migrate_db()
+    with app.db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == len(app.MIGRATIONS)
+        assert conn.execute('SELECT COUNT(*) FROM confirmed_orders').fetchone()[0] == 3
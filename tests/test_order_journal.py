@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIRMATIONS = 1000
+
+# Journals CONFIRMATIONS orders, then dies on the flusher's second batch
+CRASH = '''
+import os, sys, threading, time
+import app
+
+mode, confirmations = sys.argv[1], int(sys.argv[2])
+repo = app.orders_repo
+apply_confirmations = repo.apply_confirmations
+gate = threading.Event()
+calls = []
+
+def crashing_apply(entries):
+    gate.wait()
+    calls.append(len(entries))
+    if len(calls) == 2:
+        if mode == "mid_batch":
+            # Rows are inserted but the transaction never commits
+            with app.db_connection() as conn:
+                repo._insert_batches(conn.cursor(), [entry[1:] for entry in entries])
+                os._exit(9)
+        apply_confirmations(entries)
+        os._exit(9)  # committed, never acknowledged in the journal
+    return apply_confirmations(entries)
+
+repo.apply_confirmations = crashing_apply
+for i in range(confirmations):
+    app.order_writer.submit(f"s{i}", [{"manga": 1, "queijo": 2}])
+gate.set()
+time.sleep(30)
+sys.exit("the flusher was not killed")
+'''
+
+# A new process replays the journal left behind and reports what reached the database
+RECOVER = '''
+import json
+import app
+
+flushed = app.order_writer.flush(30)
+with app.db_connection() as conn:
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), SUM(quantity) FROM confirmed_orders")
+    rows, quantity = cur.fetchone()
+    cur.execute("SELECT COUNT(*) FROM applied_confirmations")
+    keys = cur.fetchone()[0]
+print(json.dumps(dict(app.order_writer.stats(), flushed_in_time=flushed, rows=rows,
+                      quantity=quantity, keys=keys, mismatches=app.orders_repo.rebuild_totals())))
+'''
+
+
+def _run(tmp_path, code, *args):
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+               ORDER_JOURNAL_DIR=str(tmp_path / 'order_journal'),
+               SOCKETIO_ASYNC_MODE='threading')
+    return subprocess.run([sys.executable, '-c', code, *args], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.mark.parametrize('mode', ['mid_batch', 'after_commit'])
+def test_flusher_killed_mid_batch_loses_and_duplicates_nothing(tmp_path, mode):
+    crashed = _run(tmp_path, CRASH, mode, str(CONFIRMATIONS))
+    assert crashed.returncode == 9, crashed.stdout + crashed.stderr
+
+    recovered = _run(tmp_path, RECOVER)
+    assert recovered.returncode == 0, recovered.stdout + recovered.stderr
+    result = json.loads(recovered.stdout.strip().splitlines()[-1])
+
+    assert result['flushed_in_time']
+    assert result['replayed'] > 0
+    assert result['keys'] == CONFIRMATIONS
+    assert result['rows'] == 2 * CONFIRMATIONS
+    assert result['quantity'] == 3 * CONFIRMATIONS
+    assert result['mismatches'] == 0
+    if mode == 'after_commit':
+        # The committed batch is replayed but skipped by its confirmation ids
+        assert result['duplicates'] > 0
+    else:
+        assert result['duplicates'] == 0
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+
+import pytest
+
+import app
+
+SESSIONS = 8
+CLIENTS = 32
+MESSAGES_PER_CLIENT = 100
+TIMER_EVENTS = 2000
+
+
+def _start_collecting(session_id):
+    with app.session_store.session(session_id) as session:
+        for message in ("oi", "1"):
+            session.process_message(message)
+
+
+def test_concurrent_messages_and_timer_events_keep_cart_totals():
+    session_ids = [f"stress-{i}" for i in range(SESSIONS)]
+    for session_id in session_ids:
+        _start_collecting(session_id)
+
+    sent = dict.fromkeys(session_ids, 0)
+    scheduled = dict.fromkeys(session_ids, 0)
+    fired = []
+    counts_lock = threading.Lock()
+    all_fired = threading.Event()
+
+    def client(seed):
+        rnd = random.Random(seed)
+        for _ in range(MESSAGES_PER_CLIENT):
+            session_id = rnd.choice(session_ids)
+            with app.session_store.session(session_id) as session:
+                session.process_message("2 mangas")
+            with counts_lock:
+                sent[session_id] += 2
+
+    def timer_events():
+        rnd = random.Random(99)
+        for _ in range(TIMER_EVENTS):
+            session_id = rnd.choice(session_ids)
+            session = app.get_user_session(session_id)
+
+            def event(session=session):
+                session.current_db.add_product("morango", 1)
+                with counts_lock:
+                    fired.append(session.session_id)
+                    if len(fired) == TIMER_EVENTS:
+                        all_fired.set()
+
+            # Timer fires reach the session the same way OrderSession's deadlines do
+            app.scheduler.schedule(rnd.random() * 0.5, lambda session=session, event=event: session.mailbox.post(event))
+            scheduled[session_id] += 1
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(CLIENTS)]
+    threads.append(threading.Thread(target=timer_events))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all_fired.wait(10)
+
+    for session_id in session_ids:
+        with app.session_store.session(session_id) as session:
+            orders = session.get_current_orders()
+            session.start_new_conversation()
+        assert orders.get("manga", 0) == sent[session_id]
+        assert orders.get("morango", 0) == scheduled[session_id]
+    assert sum(sent.values()) == 2 * CLIENTS * MESSAGES_PER_CLIENT
+
+
+@pytest.mark.parametrize('replaced', [False, True])
+def test_timer_fire_queued_behind_a_request_skips_when_replaced(replaced):
+    session_id = f"stale-fire-{replaced}"
+    _start_collecting(session_id)
+    with app.session_store.session(session_id) as session:
+        session.process_message("2 mangas")
+        session._set_timer(0.01, session._send_summary)
+        # The deadline passes while this request holds the session, so its fire is queued
+        time.sleep(0.2)
+        assert session.state == "collecting"
+        if replaced:
+            session._start_inactivity_timer()
+
+    with app.session_store.session(session_id) as session:
+        state = session.state
+        session.start_new_conversation()
+    assert state == ("collecting" if replaced else "confirming")
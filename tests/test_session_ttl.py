@@ -0,0 +1,19 @@
+import time
+
+import app
+
+
+def test_idle_session_with_empty_cart_is_evicted(monkeypatch):
+    store = app.SessionStore(ttl=0.3, sweep_interval=0.1)
+    monkeypatch.setattr(app, 'session_store', store)
+    monkeypatch.setattr(app.OrderSession, '_start_inactivity_timer',
+                        lambda self: self._set_timer(0.05, self._send_summary))
+    with store.session("empty-cart") as session:
+        for message in ("oi", "1"):
+            session.process_message(message)
+        assert session.state == "collecting" and not session.has_items()
+
+    deadline = time.monotonic() + 3
+    while store.stats()['live'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert store.stats()['live'] == 0
@@ -0,0 +1,39 @@
+import time
+
+import app
+
+
+def _bot_messages(client, until, timeout=5.0):
+    """Collect pushed bot messages until one contains `until`"""
+    messages = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for packet in client.get_received():
+            if packet['name'] == 'bot_message':
+                messages.extend(packet['args'][0]['messages'])
+        if any(until in message for message in messages):
+            break
+        time.sleep(0.02)
+    return messages
+
+
+def test_fired_timer_reaches_joined_client(monkeypatch):
+    monkeypatch.setattr(app.OrderSession, '_start_inactivity_timer',
+                        lambda self: self._set_timer(0.05, self._send_summary))
+    session_id = 'push-timer'
+    socket_client = app.socketio.test_client(app.app)
+    socket_client.emit('join', {'session_id': session_id})
+    socket_client.get_received()
+
+    http = app.app.test_client()
+    for message in ("oi", "1", "2 mangas"):
+        http.post('/send_message', json={'session_id': session_id, 'message': message})
+
+    messages = _bot_messages(socket_client, "RESUMO DO SEU PEDIDO")
+    summaries = [message for message in messages if "RESUMO DO SEU PEDIDO" in message]
+    assert summaries and "manga: 2" in summaries[0]
+    # Pushed messages are not queued again for polling
+    with app.session_store.read(session_id) as session:
+        assert session.get_pending_message() is None
+        assert session.state == "confirming"
+    socket_client.disconnect()